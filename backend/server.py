@@ -1,20 +1,29 @@
-from fastapi import FastAPI, APIRouter, HTTPException, UploadFile, File
-from fastapi.responses import Response, JSONResponse
+from fastapi import FastAPI, APIRouter, HTTPException, UploadFile, File, WebSocket, WebSocketDisconnect
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import Response, ORJSONResponse, FileResponse, StreamingResponse
 from dotenv import load_dotenv
 from starlette.middleware.cors import CORSMiddleware
 from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo import ReturnDocument
+from pymongo.errors import DuplicateKeyError
 import os
 import logging
 from pathlib import Path
 from pydantic import BaseModel, Field
 from typing import List, Optional
-import uuid
+from collections import OrderedDict
+import secrets
 from datetime import datetime, timedelta
 import base64
+import binascii
 import fitz  # PyMuPDF
 from io import BytesIO
 from PIL import Image
 import asyncio
+import threading
+from functools import lru_cache
+import aiofiles
+from concurrent.futures import ThreadPoolExecutor
 
 # Setup logging first
 logger = logging.getLogger(__name__)
@@ -23,15 +32,28 @@ logging.basicConfig(level=logging.INFO)
 ROOT_DIR = Path(__file__).parent
 load_dotenv(ROOT_DIR / '.env')
 
+PDF_FOLDER = ROOT_DIR / "pdfs-github"
+RANDOM_PDF_FOLDER = PDF_FOLDER / "Random"
+
 # MongoDB connection with fallback for production
 mongo_url = os.getenv('MONGO_URL', 'mongodb://localhost:27017')
 db_name = os.getenv('DB_NAME', 'readqueue_db')
+mongo_max_pool_size = int(os.getenv('MONGO_MAX_POOL_SIZE', '100'))
 
 logger.info(f"Connecting to MongoDB at: {mongo_url.split('@')[-1] if '@' in mongo_url else mongo_url}")
 logger.info(f"Using database: {db_name}")
+logger.info(f"MongoDB max pool size: {mongo_max_pool_size}")
 
 try:
-    client = AsyncIOMotorClient(mongo_url, serverSelectionTimeoutMS=5000)
+    client = AsyncIOMotorClient(
+        mongo_url,
+        serverSelectionTimeoutMS=5000,
+        maxPoolSize=mongo_max_pool_size,
+        minPoolSize=min(10, mongo_max_pool_size),
+        maxIdleTimeMS=30000,
+        waitQueueTimeoutMS=2500,
+        retryWrites=True
+    )
     db = client[db_name]
     logger.info("MongoDB client initialized successfully")
 except Exception as e:
@@ -39,55 +61,249 @@ except Exception as e:
     raise
 
 # Create the main app without a prefix
-app = FastAPI()
+app = FastAPI(default_response_class=ORJSONResponse)
 
 # Create a router with the /api prefix
 api_router = APIRouter(prefix="/api")
 
 # Global document storage (in-memory)
 current_document = {
-    "data": None,  # base64 encoded document
+    "data": None,  # raw document bytes
     "filename": None,
     "contentType": None,
-    "loaderSessionId": None
+    "loaderSessionId": None,
+    "pageCount": None,
+    "base64": None,  # cached encoding served by /document/current
+    "sourcePath": None,  # Path on disk when the document was auto-loaded from the library
+    "sourceMtimeNs": None  # mtime of sourcePath when it was read, to detect later overwrites
 }
 
+# Maximum participants per sub-group queue
+QUEUE_CAPACITY = 20
+
+# A join's participant insert may still be in flight this long after its slot was reserved,
+# so a queue count can only be trusted against a counter that has been idle for longer
+COUNTER_RECOUNT_GRACE = timedelta(seconds=60)
+
 # System configuration - Hardcoded to CST (UTC-6)
 TIMEZONE_OFFSET = -6  # CST (Central Standard Time)
 
+
+def compute_today_str() -> str:
+    """Today's CST date as MMDDYYYY, the prefix used for dated PDFs"""
+    return (datetime.utcnow() + timedelta(hours=TIMEZONE_OFFSET)).strftime("%m%d%Y")
+
+
+# Refreshed by a background task so request handlers don't recompute it
+today_str = compute_today_str()
+TODAY_REFRESH_SECONDS = 30
+
+# Chunk sizes for streaming uploads to disk and documents to clients
+UPLOAD_CHUNK_SIZE = 1 << 20  # 1 MiB
+DOWNLOAD_CHUNK_SIZE = 64 * 1024
+
+# Participants whose lastActive is older than this are evicted by MongoDB's TTL monitor
+PARTICIPANT_TTL_SECONDS = 900
+
+# Fields returned by the participant list reads
+PARTICIPANT_PROJECTION = {"sessionId": 1, "name": 1, "subGroup": 1, "_id": 0}
+
 # Cache for random PDF selection per day
 random_pdf_cache = {}
 
 # Cache version for forcing fresh image loads
 cache_version = 0
 
+# Bumped every time the in-memory document is replaced or cleared
+document_generation = 0
+
+# Rendered page cache - (document_generation, page_number, scale, quality) -> JPEG bytes, LRU ordered
+RENDERED_PAGE_CACHE_SIZE = 200
+rendered_pages = OrderedDict()
+render_locks = {}  # cache key -> asyncio.Lock for the render in progress
+
+# Dedicated pool for PyMuPDF work so rasterizing never blocks the event loop.
+# A single worker: PyMuPDF doesn't support concurrent use from several threads, even on
+# separate documents, and every render shares the one open handle below anyway.
+pdf_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="pdf")
+
+# Open fitz.Document for the loaded PDF, reused across page renders - (pdf bytes, document).
+# fitz.Document isn't thread-safe, so all access goes through open_document_lock.
+open_document = None
+open_document_lock = threading.Lock()
+
 # Daily reset tracking
 last_reset_date = None
 
 # WebRTC Signaling - Store signaling messages in memory
-webrtc_signals = {}  # sessionId -> list of signals
+webrtc_signals = {}  # sessionId -> asyncio.Queue of pending signals
+SIGNAL_QUEUE_SIZE = 100
+SIGNAL_LONG_POLL_TIMEOUT = 25  # seconds
+
+# Queue change notifications - subGroup -> asyncio.Event, set (and replaced) whenever that queue changes
+queue_events = {}
+QUEUE_STREAM_REFRESH_SECONDS = 30
+
+# True while the cleanup task is following queue deletions through a change stream
+queue_stream_active = False
+
+# Strong references to fire-and-forget tasks so they aren't garbage collected mid-flight
+background_tasks = set()
+
+
+def run_in_background(coro):
+    """Schedule a coroutine without awaiting it, keeping a reference until it finishes"""
+    task = asyncio.create_task(coro)
+    background_tasks.add(task)
+    task.add_done_callback(background_tasks.discard)
+    return task
+
+
+def get_open_document(pdf_bytes: bytes):
+    """Return a fitz.Document for pdf_bytes, reopening only when the document changed.
+
+    Caller must hold open_document_lock.
+    """
+    global open_document
+    if open_document is not None and open_document[0] is pdf_bytes:
+        return open_document[1]
+    
+    close_open_document()
+    open_document = (pdf_bytes, fitz.open(stream=pdf_bytes, filetype="pdf"))
+    return open_document[1]
+
+
+def close_open_document():
+    """Close the cached fitz.Document. Caller must hold open_document_lock."""
+    global open_document
+    if open_document is not None:
+        try:
+            open_document[1].close()
+        except Exception:
+            pass
+        open_document = None
+
+
+def release_open_document():
+    with open_document_lock:
+        close_open_document()
+
+
+def clear_current_document():
+    global document_generation
+    document_generation += 1
+    for key in current_document:
+        current_document[key] = None
+    # Close the handle on the PDF pool so we never wait on an in-progress render here
+    pdf_executor.submit(release_open_document)
+
+
+def prepare_document(pdf_bytes: bytes, filename: str):
+    """Compute the derived forms of a document: (page count or None, base64 string)"""
+    try:
+        # Opening here also primes the handle that page renders will reuse
+        with open_document_lock:
+            page_count = get_open_document(pdf_bytes).page_count
+    except Exception as e:
+        logger.warning(f"Could not read page count for {filename}: {e}")
+        page_count = None
+    
+    return page_count, base64.b64encode(pdf_bytes).decode("ascii")
+
+
+async def load_current_document(content: bytes, filename: str, content_type: str, loader_session_id: str,
+                                source_path: Optional[Path] = None, source_mtime_ns: Optional[int] = None):
+    """Store a document in memory, computing its page count and base64 form once up front"""
+    global document_generation
+    loop = asyncio.get_running_loop()
+    page_count, encoded = await loop.run_in_executor(pdf_executor, prepare_document, content, filename)
+    
+    document_generation += 1
+    current_document["data"] = content
+    current_document["filename"] = filename
+    current_document["contentType"] = content_type
+    current_document["loaderSessionId"] = loader_session_id
+    current_document["pageCount"] = page_count
+    current_document["base64"] = encoded
+    current_document["sourcePath"] = source_path
+    current_document["sourceMtimeNs"] = source_mtime_ns
+    rendered_pages.clear()
+
+
+def queue_change_event(subGroup: str) -> asyncio.Event:
+    """Event that will be set on the next change to a sub-group's queue"""
+    if subGroup not in queue_events:
+        queue_events[subGroup] = asyncio.Event()
+    return queue_events[subGroup]
+
+
+def notify_queue_change(subGroup: Optional[str] = None):
+    """Wake status streams watching a sub-group, or every sub-group when none is given"""
+    subgroups = [subGroup] if subGroup is not None else list(queue_events)
+    for name in subgroups:
+        event = queue_events.pop(name, None)
+        if event is not None:
+            event.set()
+
+
+def schedule_subgroup_cleanup(sg_name: str):
+    """Clean up a sub-group after a removal, unless the queue change stream already will"""
+    if not queue_stream_active:
+        run_in_background(cleanup_subgroup_if_empty(sg_name))
+
+
+async def cleanup_subgroup_if_empty(sg_name: str):
+    """Delete a sub-group as soon as its last participant is gone"""
+    if not sg_name or sg_name == "General":
+        return
+    counter = await db.counters.find_one({"_id": sg_name}, {"version": 1})
+    if await db.queue.count_documents({"subGroup": sg_name}, limit=1) != 0:
+        return
+    if counter is not None:
+        # A join that reserved a slot since the counter was read keeps the sub-group
+        result = await db.counters.delete_one({"_id": sg_name, "version": counter.get("version")})
+        if result.deleted_count == 0:
+            return
+    await db.subgroups.delete_one({"name": sg_name})
+    
+    # A join whose insert was still in flight during the count needs its sub-group back
+    if await db.queue.count_documents({"subGroup": sg_name}, limit=1) != 0:
+        await ensure_subgroup(sg_name)
+        return
+    logger.info(f"Auto-cleaned inactive sub-group: {sg_name}")
+
+
+async def clear_all_participants():
+    """Empty every queue and its slot counter, returning the queue DeleteResult.
+
+    The two collections can't share a bulk_write, so the deletes are issued concurrently.
+    """
+    queue_result, _ = await asyncio.gather(
+        db.queue.delete_many({}),
+        db.counters.delete_many({})
+    )
+    webrtc_signals.clear()
+    notify_queue_change()
+    return queue_result
 
 
 async def check_and_perform_daily_reset():
     """Check if we need to perform a daily reset based on CST date"""
     global last_reset_date, current_document, cache_version
     
-    cst_time = datetime.utcnow() + timedelta(hours=TIMEZONE_OFFSET)
-    today = cst_time.strftime("%Y-%m-%d")
+    today = today_str
     
     if last_reset_date != today:
         logger.info(f"Performing daily reset. Last reset: {last_reset_date}, Today: {today}")
         
         # Clear document
-        current_document["data"] = None
-        current_document["filename"] = None
-        current_document["contentType"] = None
-        current_document["loaderSessionId"] = None
+        clear_current_document()
         
         cache_version += 1
+        rendered_pages.clear()
         
         # Clear all queues
-        await db.queue.delete_many({})
+        await clear_all_participants()
         
         last_reset_date = today
         logger.info(f"Daily reset complete. Random PDF cache preserved: {list(random_pdf_cache.keys())}")
@@ -95,6 +311,136 @@ async def check_and_perform_daily_reset():
     return False
 
 
+async def reserve_queue_slot(subGroup: str) -> bool:
+    """Atomically claim a slot in a sub-group queue, returning False if the queue is full"""
+    for _ in range(3):
+        counter = await db.counters.find_one_and_update(
+            {"_id": subGroup, "active": {"$lt": QUEUE_CAPACITY}},
+            {"$inc": {"active": 1, "version": 1}, "$set": {"reservedAt": datetime.utcnow()}},
+            return_document=ReturnDocument.AFTER
+        )
+        if counter is not None:
+            return True
+        
+        counter = await db.counters.find_one({"_id": subGroup})
+        if counter is None:
+            await seed_queue_counter(subGroup)
+        elif not await recount_queue_counter(counter):
+            return False
+    return False
+
+
+async def seed_queue_counter(subGroup: str):
+    """Create a missing counter from the participants already queued.
+
+    Never touches an existing counter: it may cover reservations whose inserts haven't landed.
+    """
+    actual = await db.queue.count_documents({"subGroup": subGroup})
+    try:
+        await db.counters.update_one(
+            {"_id": subGroup},
+            {"$setOnInsert": {"active": actual, "version": 0, "reservedAt": datetime.utcnow()}},
+            upsert=True
+        )
+    except DuplicateKeyError:
+        pass  # Seeded by a concurrent join
+
+
+async def recount_queue_counter(counter: dict) -> bool:
+    """Lower a full counter to the queue size to recover slots never released (TTL expiry).
+
+    Only recounts a counter with no reservation inside COUNTER_RECOUNT_GRACE, and only if no
+    reserve or release bumped its version meanwhile. Returns True if slots were recovered.
+    """
+    reserved_at = counter.get("reservedAt")
+    if reserved_at and datetime.utcnow() - reserved_at < COUNTER_RECOUNT_GRACE:
+        return False
+    actual = await db.queue.count_documents({"subGroup": counter["_id"]})
+    if actual >= counter["active"]:
+        return False
+    result = await db.counters.update_one(
+        {"_id": counter["_id"], "version": counter.get("version")},
+        {"$set": {"active": actual}, "$inc": {"version": 1}}
+    )
+    return result.modified_count == 1
+
+
+async def release_queue_slot(subGroup: str):
+    """Give back a slot claimed by reserve_queue_slot after a participant is removed"""
+    await db.counters.update_one(
+        {"_id": subGroup, "active": {"$gt": 0}},
+        {"$inc": {"active": -1, "version": 1}}
+    )
+
+
+async def ensure_subgroup(name: str):
+    """Create a sub-group on first use so joins can name new ones"""
+    try:
+        result = await db.subgroups.update_one(
+            {"name": name},
+            {"$setOnInsert": {"id": secrets.token_hex(16), "createdAt": datetime.utcnow()}},
+            upsert=True
+        )
+    except DuplicateKeyError:
+        return  # Created by a concurrent join
+    if result.upserted_id is not None:
+        logger.info(f"Auto-created sub-group: {name}")
+
+
+def get_rendered_page(key):
+    """Return cached JPEG bytes for a rendered page, or None on a miss"""
+    img_data = rendered_pages.get(key)
+    if img_data is not None:
+        rendered_pages.move_to_end(key)
+    return img_data
+
+
+def store_rendered_page(key, img_data: bytes):
+    rendered_pages[key] = img_data
+    rendered_pages.move_to_end(key)
+    while len(rendered_pages) > RENDERED_PAGE_CACHE_SIZE:
+        rendered_pages.popitem(last=False)
+
+
+async def save_upload_to_file(file: UploadFile, file_path: Path) -> int:
+    """Stream an uploaded file to disk chunk by chunk, returning the number of bytes written"""
+    size = 0
+    async with aiofiles.open(file_path, 'wb') as f:
+        while chunk := await file.read(UPLOAD_CHUNK_SIZE):
+            await f.write(chunk)
+            size += len(chunk)
+    # Overwriting an existing file doesn't change the folder mtime, so drop cached listings
+    scan_pdf_folder.cache_clear()
+    return size
+
+
+@lru_cache(maxsize=8)
+def scan_pdf_folder(folder_path: str, mtime_ns: int) -> list:
+    """List the PDFs in a folder, sorted by filename.
+
+    Cached per folder mtime so unchanged folders skip the per-file stat calls.
+    Callers must treat the returned list as read-only.
+    """
+    pdf_files = []
+    for pdf_file in Path(folder_path).glob("*.pdf"):
+        if pdf_file.is_file():
+            stat = pdf_file.stat()
+            pdf_files.append({
+                "filename": pdf_file.name,
+                "size": stat.st_size,
+                "modified": datetime.fromtimestamp(stat.st_mtime).isoformat()
+            })
+    
+    pdf_files.sort(key=lambda x: x["filename"])
+    return pdf_files
+
+
+def list_pdf_folder(folder: Path) -> list:
+    if not folder.exists():
+        return []
+    return scan_pdf_folder(str(folder), folder.stat().st_mtime_ns)
+
+
 # Define Models
 class CreateSubGroupRequest(BaseModel):
     name: str
@@ -176,7 +522,7 @@ async def create_subgroup(request: CreateSubGroupRequest):
     if existing:
         raise HTTPException(status_code=400, detail="Sub-group with this name already exists")
     
-    subgroup_id = str(uuid.uuid4())
+    subgroup_id = secrets.token_hex(16)
     now = datetime.utcnow()
     
     subgroup = {
@@ -185,7 +531,10 @@ async def create_subgroup(request: CreateSubGroupRequest):
         "createdAt": now
     }
     
-    await db.subgroups.insert_one(subgroup)
+    try:
+        await db.subgroups.insert_one(subgroup)
+    except DuplicateKeyError:
+        raise HTTPException(status_code=400, detail="Sub-group with this name already exists")
     logger.info(f"Sub-group created: {request.name} (ID: {subgroup_id})")
     
     return {
@@ -206,6 +555,8 @@ async def delete_subgroup(subgroup_name: str):
     
     queue_result = await db.queue.delete_many({"subGroup": subgroup_name})
     await db.subgroups.delete_one({"name": subgroup_name})
+    await db.counters.delete_one({"_id": subgroup_name})
+    notify_queue_change(subgroup_name)
     
     logger.info(f"Sub-group deleted: {subgroup_name} (cleared {queue_result.deleted_count} participants)")
     
@@ -230,22 +581,10 @@ async def join_queue(request: JoinQueueRequest):
     # Check for daily reset on first queue join
     await check_and_perform_daily_reset()
     
-    subgroup = await db.subgroups.find_one({"name": request.subGroup})
-    if not subgroup:
-        subgroup_id = str(uuid.uuid4())
-        await db.subgroups.insert_one({
-            "id": subgroup_id,
-            "name": request.subGroup,
-            "createdAt": datetime.utcnow()
-        })
-        logger.info(f"Auto-created sub-group: {request.subGroup}")
-    
-    current_count = await db.queue.count_documents({"subGroup": request.subGroup})
+    if not await reserve_queue_slot(request.subGroup):
+        raise HTTPException(status_code=400, detail=f"Queue for '{request.subGroup}' is full (maximum {QUEUE_CAPACITY} participants)")
     
-    if current_count >= 20:
-        raise HTTPException(status_code=400, detail=f"Queue for '{request.subGroup}' is full (maximum 20 participants)")
-    
-    session_id = str(uuid.uuid4())
+    session_id = secrets.token_hex(16)
     now = datetime.utcnow()
     
     participant = {
@@ -256,13 +595,25 @@ async def join_queue(request: JoinQueueRequest):
         "lastActive": now
     }
     
-    await db.queue.insert_one(participant)
+    # Creating the sub-group rides alongside the insert instead of costing its own round-trip
+    inserted, created = await asyncio.gather(
+        db.queue.insert_one(participant),
+        ensure_subgroup(request.subGroup),
+        return_exceptions=True
+    )
+    if isinstance(inserted, Exception):
+        await release_queue_slot(request.subGroup)
+        raise inserted
+    if isinstance(created, Exception):
+        logger.error(f"Failed to create sub-group '{request.subGroup}': {created}")
     
     position = await db.queue.count_documents({
         "subGroup": request.subGroup,
         "joinedAt": {"$lte": now}
     })
     
+    notify_queue_change(request.subGroup)
+    
     logger.info(f"{request.name} joined sub-group '{request.subGroup}' at position {position}")
     
     return JoinQueueResponse(
@@ -274,19 +625,84 @@ async def join_queue(request: JoinQueueRequest):
 
 @api_router.get("/queue/status/{sessionId}", response_model=QueueStatusResponse)
 async def get_queue_status(sessionId: str):
-    participant = await db.queue.find_one({"sessionId": sessionId})
+    return await build_queue_status(sessionId)
+
+@api_router.websocket("/ws/queue/{sessionId}")
+async def queue_status_stream(websocket: WebSocket, sessionId: str):
+    """Push the same payload as /queue/status whenever the participant's sub-group changes"""
+    await websocket.accept()
+    
+    # Watch the socket alongside the change event so a client close ends the stream
+    # instead of surfacing as an error from the next send
+    receive_task = None
+    try:
+        participant = await db.queue.find_one({"sessionId": sessionId}, {"subGroup": 1, "_id": 0})
+        if not participant:
+            await close_queue_stream(websocket, "Participant not found in queue")
+            return
+        subGroup = participant["subGroup"]
+        
+        while True:
+            # Grab the event before reading so a change during the read isn't missed
+            event = queue_change_event(subGroup)
+            try:
+                status = await build_queue_status(sessionId)
+            except HTTPException as e:
+                await close_queue_stream(websocket, e.detail)
+                return
+            
+            try:
+                await websocket.send_json(jsonable_encoder(status))
+            except Exception:
+                break
+            
+            if receive_task is None:
+                receive_task = asyncio.ensure_future(websocket.receive())
+            event_task = asyncio.ensure_future(event.wait())
+            
+            # Periodic refresh also keeps lastActive current for the TTL index
+            done, _ = await asyncio.wait(
+                {event_task, receive_task},
+                timeout=QUEUE_STREAM_REFRESH_SECONDS,
+                return_when=asyncio.FIRST_COMPLETED
+            )
+            event_task.cancel()
+            
+            if receive_task in done:
+                message = receive_task.result()
+                receive_task = None
+                if message["type"] == "websocket.disconnect":
+                    break
+    finally:
+        if receive_task is not None:
+            receive_task.cancel()
+        logger.info(f"Queue status stream closed for {sessionId}")
+
+
+async def close_queue_stream(websocket: WebSocket, detail: str):
+    try:
+        await websocket.send_json({"detail": detail})
+        await websocket.close(code=4404)
+    except Exception:
+        pass  # Client already gone
+
+async def build_queue_status(sessionId: str) -> QueueStatusResponse:
+    participant = await db.queue.find_one({"sessionId": sessionId}, {"subGroup": 1, "_id": 0})
     
     if not participant:
         raise HTTPException(status_code=404, detail="Participant not found in queue")
     
     subGroup = participant["subGroup"]
     
-    await db.queue.update_one(
+    # Heartbeat write doesn't affect the response, so don't hold the poll on it
+    run_in_background(db.queue.update_one(
         {"sessionId": sessionId},
         {"$set": {"lastActive": datetime.utcnow()}}
-    )
+    ))
     
-    all_participants = await db.queue.find({"subGroup": subGroup}).sort("joinedAt", 1).to_list(20)
+    all_participants = await db.queue.find(
+        {"subGroup": subGroup}, PARTICIPANT_PROJECTION
+    ).sort("joinedAt", 1).to_list(QUEUE_CAPACITY)
     
     position = next((i + 1 for i, p in enumerate(all_participants) if p["sessionId"] == sessionId), 0)
     
@@ -315,6 +731,7 @@ async def handle_queue_action(request: QueueAction):
             {"sessionId": request.sessionId},
             {"$set": {"joinedAt": datetime.utcnow(), "lastActive": datetime.utcnow()}}
         )
+        notify_queue_change(participant["subGroup"])
         return {"message": f"Action '{request.action}' processed. You've been moved to the end of the queue in {participant['subGroup']}."}
     
     elif request.action == "start":
@@ -329,11 +746,16 @@ async def handle_queue_action(request: QueueAction):
 
 @api_router.delete("/queue/leave/{sessionId}")
 async def leave_queue(sessionId: str):
-    result = await db.queue.delete_one({"sessionId": sessionId})
+    participant = await db.queue.find_one_and_delete({"sessionId": sessionId}, {"subGroup": 1})
     
-    if result.deleted_count == 0:
+    if not participant:
         raise HTTPException(status_code=404, detail="Participant not found in queue")
     
+    await release_queue_slot(participant["subGroup"])
+    webrtc_signals.pop(sessionId, None)
+    notify_queue_change(participant["subGroup"])
+    schedule_subgroup_cleanup(participant["subGroup"])
+    
     return {"message": "You have left the queue"}
 
 @api_router.delete("/queue/remove/{sessionId}")
@@ -349,6 +771,11 @@ async def remove_participant(sessionId: str):
     if result.deleted_count == 0:
         raise HTTPException(status_code=404, detail="Failed to remove participant")
     
+    await release_queue_slot(participant["subGroup"])
+    webrtc_signals.pop(sessionId, None)
+    notify_queue_change(participant["subGroup"])
+    schedule_subgroup_cleanup(participant["subGroup"])
+    
     logger.info(f"Admin removed participant '{participant.get('name')}' from queue")
     return {
         "success": True,
@@ -359,17 +786,16 @@ async def remove_participant(sessionId: str):
 
 @api_router.get("/queue/all")
 async def get_all_queue():
-    participants = await db.queue.find().sort("joinedAt", 1).to_list(100)
-    
-    for participant in participants:
-        if "_id" in participant:
-            participant["_id"] = str(participant["_id"])
+    participants = await db.queue.find({}, PARTICIPANT_PROJECTION).sort("joinedAt", 1).to_list(length=None)
     
     return {"queue": participants, "total": len(participants)}
 
 @api_router.delete("/queue/clear/{subGroup}")
 async def clear_subgroup_queue(subGroup: str):
     result = await db.queue.delete_many({"subGroup": subGroup})
+    await db.counters.delete_one({"_id": subGroup})
+    notify_queue_change(subGroup)
+    schedule_subgroup_cleanup(subGroup)
     logger.info(f"Admin cleared {result.deleted_count} participants from sub-group '{subGroup}'")
     return {
         "success": True,
@@ -381,7 +807,7 @@ async def clear_subgroup_queue(subGroup: str):
 @api_router.delete("/queue/clear-all")
 async def clear_all_queues():
     """Clear all participants from all queues"""
-    result = await db.queue.delete_many({})
+    result = await clear_all_participants()
     logger.info(f"Admin cleared all queues: {result.deleted_count} participants removed")
     return {
         "success": True,
@@ -416,28 +842,28 @@ async def auto_load_document(loaderSessionId: str = None, force: bool = False):
     
     if force and current_document["data"] is not None:
         logger.info(f"Force reload requested, clearing current document: {current_document.get('filename')}")
-        current_document["data"] = None
-        current_document["filename"] = None
-        current_document["contentType"] = None
-        current_document["loaderSessionId"] = None
+        clear_current_document()
         cache_version += 1
+        rendered_pages.clear()
         logger.info(f"Cache version incremented to {cache_version}")
     
-    cst_time = datetime.utcnow() + timedelta(hours=TIMEZONE_OFFSET)
-    today = cst_time.strftime("%m%d%Y")
+    today = today_str
     logger.info(f"Using timezone offset: UTC{TIMEZONE_OFFSET:+d} (CST), Date: {today}")
-    pdf_folder = Path(__file__).parent / "pdfs-github"
+    pdf_folder = PDF_FOLDER
     
     logger.info(f"Searching for PDF with date: {today} in {pdf_folder}")
     
-    matching_files = list(pdf_folder.glob(f"{today}_*.pdf"))
+    matching_files = [
+        pdf_folder / f["filename"] for f in list_pdf_folder(pdf_folder)
+        if f["filename"].startswith(f"{today}_")
+    ]
     
     if not matching_files:
         logger.warning(f"No PDF found for today's date: {today}, checking Random folder for fallback...")
         
         if today in random_pdf_cache:
             cached_filename = random_pdf_cache[today]
-            random_folder = pdf_folder / "Random"
+            random_folder = RANDOM_PDF_FOLDER
             pdf_file = random_folder / cached_filename
             
             if pdf_file.exists():
@@ -451,9 +877,9 @@ async def auto_load_document(loaderSessionId: str = None, force: bool = False):
         
         if pdf_file is None or not pdf_file.exists():
             import random
-            random_folder = pdf_folder / "Random"
+            random_folder = RANDOM_PDF_FOLDER
             if random_folder.exists():
-                random_files = list(random_folder.glob("*.pdf"))
+                random_files = [random_folder / f["filename"] for f in list_pdf_folder(random_folder)]
                 if random_files:
                     pdf_file = random.choice(random_files)
                     random_pdf_cache[today] = pdf_file.name
@@ -478,17 +904,17 @@ async def auto_load_document(loaderSessionId: str = None, force: bool = False):
         logger.info(f"Loading PDF: {pdf_file.name}")
     
     try:
-        with open(pdf_file, 'rb') as f:
-            content = f.read()
-        
-        encoded_content = base64.b64encode(content).decode('utf-8')
+        # Stat before reading: if the file changes mid-read the recorded mtime won't match later
+        source_mtime_ns = pdf_file.stat().st_mtime_ns
+        async with aiofiles.open(pdf_file, 'rb') as f:
+            content = await f.read()
         
-        current_document["data"] = encoded_content
-        current_document["filename"] = pdf_file.name
-        current_document["contentType"] = "application/pdf"
-        current_document["loaderSessionId"] = loaderSessionId
+        await load_current_document(
+            content, pdf_file.name, "application/pdf", loaderSessionId,
+            source_path=pdf_file, source_mtime_ns=source_mtime_ns
+        )
         
-        logger.info(f"Auto-loaded PDF: {pdf_file.name}, size: ~{len(content)} bytes, loader: {loaderSessionId}")
+        logger.info(f"Auto-loaded PDF: {pdf_file.name}, size: {len(content)} bytes, loader: {loaderSessionId}")
         
         return {
             "success": True,
@@ -505,12 +931,8 @@ async def upload_document(file: UploadFile = File(...), loaderSessionId: str = N
     global current_document
     
     content = await file.read()
-    encoded_content = base64.b64encode(content).decode('utf-8')
     
-    current_document["data"] = encoded_content
-    current_document["filename"] = file.filename
-    current_document["contentType"] = file.content_type
-    current_document["loaderSessionId"] = loaderSessionId
+    await load_current_document(content, file.filename, file.content_type, loaderSessionId)
     
     logger.info(f"Document uploaded: {file.filename}, size: {len(content)} bytes, loader: {loaderSessionId}")
     
@@ -521,18 +943,22 @@ async def upload_document(file: UploadFile = File(...), loaderSessionId: str = N
         "message": "Document uploaded successfully"
     }
 
-@api_router.post("/document/upload-base64")
+@api_router.post("/document/upload-base64", deprecated=True)
 async def upload_document_base64(upload_data: UploadDocumentBase64):
+    """Deprecated: POST the raw file to /document/upload instead, which skips the base64 overhead"""
     global current_document
     
-    current_document["data"] = upload_data.data
-    current_document["filename"] = upload_data.filename
-    current_document["contentType"] = upload_data.contentType
-    current_document["loaderSessionId"] = upload_data.loaderSessionId
+    loop = asyncio.get_running_loop()
+    try:
+        content = await loop.run_in_executor(None, base64.b64decode, upload_data.data)
+    except binascii.Error as e:
+        raise HTTPException(status_code=400, detail=f"Invalid base64 document data: {str(e)}")
+    
+    await load_current_document(content, upload_data.filename, upload_data.contentType, upload_data.loaderSessionId)
     
-    data_size = len(upload_data.data) * 3 // 4
+    data_size = len(content)
     
-    logger.info(f"Document uploaded (base64): {upload_data.filename}, size: ~{data_size} bytes, loader: {upload_data.loaderSessionId}")
+    logger.info(f"Document uploaded (base64): {upload_data.filename}, size: {data_size} bytes, loader: {upload_data.loaderSessionId}")
     
     return {
         "success": True,
@@ -551,7 +977,7 @@ async def get_current_document():
     return {
         "filename": current_document["filename"],
         "contentType": current_document["contentType"],
-        "data": current_document["data"]
+        "data": current_document["base64"]
     }
 
 @api_router.get("/document/view")
@@ -561,16 +987,26 @@ async def view_current_document():
     if not current_document["data"]:
         raise HTTPException(status_code=404, detail="No document loaded")
     
-    pdf_bytes = base64.b64decode(current_document["data"])
+    data = current_document["data"]
+    media_type = current_document["contentType"] or "application/pdf"
+    headers = {
+        "Content-Disposition": f'inline; filename="{current_document["filename"]}"',
+        "Cache-Control": "no-cache"
+    }
     
-    return Response(
-        content=pdf_bytes,
-        media_type=current_document["contentType"] or "application/pdf",
-        headers={
-            "Content-Disposition": f'inline; filename="{current_document["filename"]}"',
-            "Cache-Control": "no-cache"
-        }
-    )
+    # Serve straight from disk when the library file still matches what's loaded
+    source_path = current_document["sourcePath"]
+    if source_path is not None and source_path.is_file():
+        stat = source_path.stat()
+        if stat.st_size == len(data) and stat.st_mtime_ns == current_document["sourceMtimeNs"]:
+            return FileResponse(source_path, media_type=media_type, headers=headers)
+    
+    async def iter_document_bytes():
+        for offset in range(0, len(data), DOWNLOAD_CHUNK_SIZE):
+            yield data[offset:offset + DOWNLOAD_CHUNK_SIZE]
+    
+    headers["Content-Length"] = str(len(data))
+    return StreamingResponse(iter_document_bytes(), media_type=media_type, headers=headers)
 
 @api_router.get("/document/status")
 async def get_document_status():
@@ -587,14 +1023,12 @@ async def clear_document(loaderSessionId: str = None):
     global current_document, cache_version
     # Note: We do NOT clear random_pdf_cache here - it should persist for the entire day
     
-    current_document["data"] = None
-    current_document["filename"] = None
-    current_document["contentType"] = None
-    current_document["loaderSessionId"] = None
+    clear_current_document()
     
     cache_version += 1
+    rendered_pages.clear()
     
-    await db.queue.delete_many({})
+    await clear_all_participants()
     
     logger.info(f"Document cleared by loader: {loaderSessionId}, queue reset, cache version: {cache_version}. Random PDF cache preserved.")
     
@@ -605,36 +1039,24 @@ async def clear_document(loaderSessionId: str = None):
     }
 
 @api_router.get("/document/pages")
-async def get_document_pages():
+async def get_document_pages(response: Response):
     global current_document
     
     if not current_document["data"]:
         raise HTTPException(status_code=404, detail="No document loaded")
     
-    try:
-        pdf_bytes = base64.b64decode(current_document["data"])
-        pdf_document = fitz.open(stream=pdf_bytes, filetype="pdf")
-        page_count = pdf_document.page_count
-        
-        logger.info(f"PDF has {page_count} pages")
-        
-        pdf_document.close()
-        
-        return JSONResponse(
-            content={
-                "pageCount": page_count,
-                "filename": current_document["filename"],
-                "timestamp": datetime.utcnow().timestamp()
-            },
-            headers={
-                "Cache-Control": "no-store, no-cache, must-revalidate, max-age=0",
-                "Pragma": "no-cache",
-                "Expires": "0"
-            }
-        )
-    except Exception as e:
-        logger.error(f"Error reading PDF: {str(e)}")
-        raise HTTPException(status_code=500, detail=f"Error processing PDF: {str(e)}")
+    if current_document["pageCount"] is None:
+        raise HTTPException(status_code=500, detail="Error processing PDF: page count unavailable")
+    
+    response.headers["Cache-Control"] = "no-store, no-cache, must-revalidate, max-age=0"
+    response.headers["Pragma"] = "no-cache"
+    response.headers["Expires"] = "0"
+    
+    return {
+        "pageCount": current_document["pageCount"],
+        "filename": current_document["filename"],
+        "timestamp": datetime.utcnow().timestamp()
+    }
 
 @api_router.get("/document/page/{page_number}")
 async def get_document_page(page_number: int, quality: int = 90, scale: float = 2.0):
@@ -643,74 +1065,80 @@ async def get_document_page(page_number: int, quality: int = 90, scale: float =
     if not current_document["data"]:
         raise HTTPException(status_code=404, detail="No document loaded")
     
-    pdf_document = None
+    # Pin the document this request renders so a concurrent upload can't swap it mid-render
+    pdf_bytes = current_document["data"]
+    generation = document_generation
+    
+    scale = round(scale, 2)
+    cache_key = (generation, page_number, scale, quality)
+    
+    img_data = get_rendered_page(cache_key)
+    if img_data is None:
+        # Only one request renders a given page; concurrent requests wait and hit the cache
+        lock = render_locks.setdefault(cache_key, asyncio.Lock())
+        async with lock:
+            try:
+                img_data = get_rendered_page(cache_key)
+                if img_data is None:
+                    loop = asyncio.get_running_loop()
+                    img_data = await loop.run_in_executor(
+                        pdf_executor, render_document_page,
+                        pdf_bytes, page_number, scale, quality
+                    )
+                    # Don't cache a page of a document that was replaced while it rendered
+                    if generation == document_generation:
+                        store_rendered_page(cache_key, img_data)
+                    logger.info(f"Rendered page {page_number} at scale {scale}x, quality {quality}")
+            finally:
+                render_locks.pop(cache_key, None)
+    
+    return Response(
+        content=img_data,
+        media_type="image/jpeg",
+        headers={
+            "Cache-Control": "no-store, no-cache, must-revalidate, max-age=0",
+            "Pragma": "no-cache",
+            "Expires": "0",
+            "Content-Disposition": f'inline; filename="page_{page_number}.jpg"'
+        }
+    )
+
+
+def render_document_page(pdf_bytes: bytes, page_number: int, scale: float, quality: int) -> bytes:
+    """Render a single PDF page to JPEG bytes"""
     try:
-        pdf_bytes = base64.b64decode(current_document["data"])
-        pdf_document = fitz.open(stream=pdf_bytes, filetype="pdf")
-        
-        if page_number < 0 or page_number >= pdf_document.page_count:
-            page_count = pdf_document.page_count
-            pdf_document.close()
-            raise HTTPException(
-                status_code=400, 
-                detail=f"Invalid page number. Document has {page_count} pages (0-indexed)"
-            )
-        
-        page = pdf_document[page_number]
-        mat = fitz.Matrix(scale, scale)
-        pix = page.get_pixmap(matrix=mat)
-        
-        img_data = pix.tobytes("jpeg", jpg_quality=quality)
-        
-        pdf_document.close()
-        pdf_document = None
-        
-        logger.info(f"Rendered page {page_number} at scale {scale}x, quality {quality}")
-        
-        return Response(
-            content=img_data,
-            media_type="image/jpeg",
-            headers={
-                "Cache-Control": "no-store, no-cache, must-revalidate, max-age=0",
-                "Pragma": "no-cache",
-                "Expires": "0",
-                "Content-Disposition": f'inline; filename="page_{page_number}.jpg"'
-            }
-        )
+        with open_document_lock:
+            pdf_document = get_open_document(pdf_bytes)
+            
+            if page_number < 0 or page_number >= pdf_document.page_count:
+                raise HTTPException(
+                    status_code=400, 
+                    detail=f"Invalid page number. Document has {pdf_document.page_count} pages (0-indexed)"
+                )
+            
+            page = pdf_document[page_number]
+            mat = fitz.Matrix(scale, scale)
+            pix = page.get_pixmap(matrix=mat)
+            
+            return pix.tobytes("jpeg", jpg_quality=quality)
         
     except HTTPException:
         raise
     except Exception as e:
         logger.error(f"Error rendering page {page_number}: {str(e)}")
         raise HTTPException(status_code=500, detail=f"Error rendering page: {str(e)}")
-    finally:
-        if pdf_document is not None:
-            try:
-                pdf_document.close()
-            except Exception:
-                pass
 
 
 # PDF Library Management
 @api_router.get("/document/library")
 async def list_pdf_library():
     try:
-        pdf_folder = Path(__file__).parent / "pdfs-github"
+        pdf_folder = PDF_FOLDER
         if not pdf_folder.exists():
             pdf_folder.mkdir(parents=True, exist_ok=True)
             return {"files": []}
         
-        pdf_files = []
-        for pdf_file in pdf_folder.glob("*.pdf"):
-            if pdf_file.is_file():
-                stat = pdf_file.stat()
-                pdf_files.append({
-                    "filename": pdf_file.name,
-                    "size": stat.st_size,
-                    "modified": datetime.fromtimestamp(stat.st_mtime).isoformat()
-                })
-        
-        pdf_files.sort(key=lambda x: x["filename"])
+        pdf_files = list_pdf_folder(pdf_folder)
         
         return {"files": pdf_files, "count": len(pdf_files)}
     except Exception as e:
@@ -725,7 +1153,7 @@ async def upload_pdf_to_library(file: UploadFile = File(...)):
         if not file.filename.endswith('.pdf'):
             raise HTTPException(status_code=400, detail="Only PDF files are allowed")
         
-        pdf_folder = Path(__file__).parent / "pdfs-github"
+        pdf_folder = PDF_FOLDER
         if not pdf_folder.exists():
             pdf_folder.mkdir(parents=True, exist_ok=True)
         
@@ -734,30 +1162,25 @@ async def upload_pdf_to_library(file: UploadFile = File(...)):
         is_currently_loaded = (current_document["data"] is not None and 
                                current_document.get("filename") == file.filename)
         
-        cst_time = datetime.utcnow() + timedelta(hours=TIMEZONE_OFFSET)
-        today = cst_time.strftime("%m%d%Y")
+        today = today_str
         is_todays_pdf = file.filename.startswith(f"{today}_")
         
         should_clear = is_currently_loaded or (is_todays_pdf and current_document["data"] is not None)
         
         if should_clear:
             logger.info("Clearing document from memory before upload")
-            current_document["data"] = None
-            current_document["filename"] = None
-            current_document["contentType"] = None
-            current_document["loaderSessionId"] = None
+            clear_current_document()
             cache_version += 1
+            rendered_pages.clear()
         
-        content = await file.read()
-        with open(file_path, 'wb') as f:
-            f.write(content)
+        size = await save_upload_to_file(file, file_path)
         
-        logger.info(f"Uploaded PDF to library: {file.filename} ({len(content)} bytes)")
+        logger.info(f"Uploaded PDF to library: {file.filename} ({size} bytes)")
         
         return {
             "success": True,
             "filename": file.filename,
-            "size": len(content),
+            "size": size,
             "cacheVersion": cache_version,
             "message": f"PDF '{file.filename}' uploaded successfully"
         }
@@ -770,7 +1193,7 @@ async def upload_pdf_to_library(file: UploadFile = File(...)):
 @api_router.delete("/document/library/{filename}")
 async def delete_pdf_from_library(filename: str):
     try:
-        pdf_folder = Path(__file__).parent / "pdfs-github"
+        pdf_folder = PDF_FOLDER
         file_path = pdf_folder / filename
         
         if not file_path.exists():
@@ -801,22 +1224,12 @@ async def delete_pdf_from_library(filename: str):
 @api_router.get("/document/library/random")
 async def list_random_library():
     try:
-        random_folder = Path(__file__).parent / "pdfs-github" / "Random"
+        random_folder = RANDOM_PDF_FOLDER
         if not random_folder.exists():
             random_folder.mkdir(parents=True, exist_ok=True)
             return {"files": [], "count": 0}
         
-        pdf_files = []
-        for pdf_file in random_folder.glob("*.pdf"):
-            if pdf_file.is_file():
-                stat = pdf_file.stat()
-                pdf_files.append({
-                    "filename": pdf_file.name,
-                    "size": stat.st_size,
-                    "modified": datetime.fromtimestamp(stat.st_mtime).isoformat()
-                })
-        
-        pdf_files.sort(key=lambda x: x["filename"])
+        pdf_files = list_pdf_folder(random_folder)
         
         return {"files": pdf_files, "count": len(pdf_files)}
     except Exception as e:
@@ -829,22 +1242,19 @@ async def upload_to_random(file: UploadFile = File(...)):
         if not file.filename.endswith('.pdf'):
             raise HTTPException(status_code=400, detail="Only PDF files are allowed")
         
-        random_folder = Path(__file__).parent / "pdfs-github" / "Random"
+        random_folder = RANDOM_PDF_FOLDER
         if not random_folder.exists():
             random_folder.mkdir(parents=True, exist_ok=True)
         
         file_path = random_folder / file.filename
-        content = await file.read()
+        size = await save_upload_to_file(file, file_path)
         
-        with open(file_path, 'wb') as f:
-            f.write(content)
-        
-        logger.info(f"Uploaded to Random: {file.filename} ({len(content)} bytes)")
+        logger.info(f"Uploaded to Random: {file.filename} ({size} bytes)")
         
         return {
             "success": True,
             "filename": file.filename,
-            "size": len(content),
+            "size": size,
             "message": f"PDF '{file.filename}' uploaded to Random folder"
         }
     except HTTPException:
@@ -856,7 +1266,7 @@ async def upload_to_random(file: UploadFile = File(...)):
 @api_router.delete("/document/library/random/{filename}")
 async def delete_random_pdf(filename: str):
     try:
-        random_folder = Path(__file__).parent / "pdfs-github" / "Random"
+        random_folder = RANDOM_PDF_FOLDER
         file_path = random_folder / filename
         
         if not file_path.exists():
@@ -878,36 +1288,109 @@ async def delete_random_pdf(filename: str):
 
 
 # WebRTC Signaling Endpoints
+def get_signal_queue(sessionId: str) -> asyncio.Queue:
+    if sessionId not in webrtc_signals:
+        webrtc_signals[sessionId] = asyncio.Queue(maxsize=SIGNAL_QUEUE_SIZE)
+    return webrtc_signals[sessionId]
+
+def drain_signal_queue(queue: asyncio.Queue, signals: list) -> list:
+    while not queue.empty():
+        signals.append(queue.get_nowait())
+    return signals
+
+def requeue_signals(queue: asyncio.Queue, signals: list):
+    """Put undelivered signals back ahead of anything queued since, preserving their order"""
+    pending = signals + drain_signal_queue(queue, [])
+    for signal in pending:
+        try:
+            queue.put_nowait(signal)
+        except asyncio.QueueFull:
+            logger.warning(f"WebRTC signal dropped while requeueing: {signal.get('type')} from {signal.get('from')}")
+
 @api_router.post("/webrtc/signal")
 async def send_webrtc_signal(signal: WebRTCSignal):
-    if signal.toSessionId not in webrtc_signals:
-        webrtc_signals[signal.toSessionId] = []
-    
-    webrtc_signals[signal.toSessionId].append({
-        "from": signal.fromSessionId,
-        "type": signal.type,
-        "data": signal.data,
-        "timestamp": datetime.utcnow()
-    })
+    try:
+        get_signal_queue(signal.toSessionId).put_nowait({
+            "from": signal.fromSessionId,
+            "type": signal.type,
+            "data": signal.data,
+            "timestamp": datetime.utcnow()
+        })
+    except asyncio.QueueFull:
+        logger.warning(f"WebRTC signal dropped, queue full for {signal.toSessionId}: {signal.type} from {signal.fromSessionId}")
+        return {"success": False, "message": "Signal queue full"}
     
     logger.info(f"WebRTC signal stored: {signal.type} from {signal.fromSessionId} to {signal.toSessionId}")
     
     return {"success": True, "message": "Signal stored"}
 
 @api_router.get("/webrtc/signals/{sessionId}")
-async def get_webrtc_signals(sessionId: str):
-    signals = webrtc_signals.get(sessionId, [])
-    if sessionId in webrtc_signals:
-        webrtc_signals[sessionId] = []
+async def get_webrtc_signals(sessionId: str, wait: float = 0):
+    """Return pending signals. With wait > 0, long-poll up to that many seconds for the first one."""
+    if wait <= 0:
+        # Plain polls must not leave a queue behind for every session id they ask about
+        queue = webrtc_signals.get(sessionId)
+        return {"signals": drain_signal_queue(queue, []) if queue is not None else []}
     
-    return {"signals": signals}
+    queue = get_signal_queue(sessionId)
+    signals = []
+    
+    if queue.empty():
+        try:
+            signals.append(await asyncio.wait_for(queue.get(), timeout=min(wait, SIGNAL_LONG_POLL_TIMEOUT)))
+        except asyncio.TimeoutError:
+            pass
+    
+    return {"signals": drain_signal_queue(queue, signals)}
+
+@api_router.websocket("/ws/webrtc/{sessionId}")
+async def webrtc_signal_stream(websocket: WebSocket, sessionId: str):
+    await websocket.accept()
+    queue = get_signal_queue(sessionId)
+    
+    # Watch the socket alongside the queue so a disconnect stops us consuming signals
+    get_task = None
+    receive_task = None
+    try:
+        while True:
+            if get_task is None:
+                get_task = asyncio.ensure_future(queue.get())
+            if receive_task is None:
+                receive_task = asyncio.ensure_future(websocket.receive())
+            
+            done, _ = await asyncio.wait({get_task, receive_task}, return_when=asyncio.FIRST_COMPLETED)
+            
+            if receive_task in done:
+                message = receive_task.result()
+                receive_task = None
+                if message["type"] == "websocket.disconnect":
+                    break
+            
+            if get_task in done:
+                signals = drain_signal_queue(queue, [get_task.result()])
+                get_task = None
+                try:
+                    await websocket.send_json({"signals": jsonable_encoder(signals)})
+                except Exception:
+                    requeue_signals(queue, signals)
+                    break
+    finally:
+        if receive_task is not None:
+            receive_task.cancel()
+        if get_task is not None:
+            get_task.cancel()
+            if get_task.done() and not get_task.cancelled():
+                requeue_signals(queue, [get_task.result()])
+        logger.info(f"WebRTC signal stream closed for {sessionId}")
 
 @api_router.get("/webrtc/peers")
 async def get_webrtc_peers(subGroup: str = None):
     if subGroup:
-        all_participants = await db.queue.find({"subGroup": subGroup}).sort("joinedAt", 1).to_list(20)
+        all_participants = await db.queue.find(
+            {"subGroup": subGroup}, PARTICIPANT_PROJECTION
+        ).sort("joinedAt", 1).to_list(QUEUE_CAPACITY)
     else:
-        all_participants = await db.queue.find().sort("joinedAt", 1).to_list(20)
+        all_participants = await db.queue.find({}, PARTICIPANT_PROJECTION).sort("joinedAt", 1).to_list(QUEUE_CAPACITY)
     
     peers = [
         {
@@ -940,43 +1423,201 @@ logging.basicConfig(
 logger = logging.getLogger(__name__)
 
 cleanup_task = None
+today_task = None
+shutdown_event = None  # asyncio.Event set when the app is shutting down, created at startup
+# How long each change stream poll waits for events before re-checking shutdown_event
+CHANGE_STREAM_MAX_AWAIT_MS = 1000
+# Backstop sweep interval bounds (seconds) and growth factor while idle
+CLEANUP_MIN_INTERVAL = 30.0
+CLEANUP_MAX_INTERVAL = 600.0
+CLEANUP_BACKOFF_FACTOR = 1.5
+# Extra wait after a failed sweep, doubling per consecutive failure
+CLEANUP_ERROR_BACKOFF = 1.0
+CLEANUP_MAX_ERROR_BACKOFF = 30.0
+
+# Sub-groups (other than General) with no participants, found server-side in one round-trip.
+# The inner $limit stops the lookup after the first participant instead of collecting them all.
+EMPTY_SUBGROUPS_PIPELINE = [
+    {"$match": {"name": {"$ne": "General", "$type": "string"}}},
+    {"$lookup": {
+        "from": "queue",
+        "let": {"name": "$name"},
+        "pipeline": [
+            {"$match": {"$expr": {"$eq": ["$subGroup", "$$name"]}}},
+            {"$limit": 1},
+            {"$project": {"_id": 1}}
+        ],
+        "as": "participants"
+    }},
+    {"$match": {"participants": {"$size": 0}}},
+    {"$project": {"name": 1, "_id": 0}}
+]
+
+async def refresh_today_str():
+    """Background task that keeps the cached CST date string current"""
+    global today_str
+    while True:
+        today_str = compute_today_str()
+        await asyncio.sleep(TODAY_REFRESH_SECONDS)
+
+@app.on_event("startup")
+async def create_indexes():
+    try:
+        await db.queue.create_index("lastActive", expireAfterSeconds=PARTICIPANT_TTL_SECONDS)
+        await db.queue.create_index([("subGroup", 1), ("joinedAt", 1)], name="sg_joined")
+        await db.queue.create_index("sessionId", unique=True)
+        # queue.subGroup lookups are already served by the sg_joined prefix
+        # Not a partial index excluding General: partialFilterExpression doesn't support $ne,
+        # and the full index already answers the sweep's {"name": {"$ne": "General"}} as two ranges
+        await db.subgroups.create_index([("name", 1)], unique=True, name="subgroups_name")
+        logger.info("MongoDB indexes ensured")
+    except Exception as e:
+        logger.error(f"Failed to create MongoDB indexes: {e}")
+    
+    try:
+        # Lets the cleanup change stream see which sub-group a deleted participant was in
+        await db.command({"collMod": "queue", "changeStreamPreAndPostImages": {"enabled": True}})
+    except Exception as e:
+        logger.info(f"Queue change stream pre-images not enabled: {e}")
 
 @app.on_event("startup")
 async def startup_cleanup_task():
-    global cleanup_task
+    global cleanup_task, shutdown_event
+    shutdown_event = asyncio.Event()
     cleanup_task = asyncio.create_task(auto_cleanup_inactive_subgroups())
     logger.info("Started auto-cleanup background task")
 
+@app.on_event("startup")
+async def startup_today_task():
+    global today_task
+    today_task = asyncio.create_task(refresh_today_str())
+
 @app.on_event("shutdown")
 async def shutdown_db_client():
-    global cleanup_task
+    global cleanup_task, today_task
+    if today_task:
+        today_task.cancel()
+    pdf_executor.shutdown(wait=False)
+    
+    # Let the cleanup task wind down while the client closes, so shutdown takes the longer of the two
+    pending = [asyncio.to_thread(client.close)]
     if cleanup_task:
-        cleanup_task.cancel()
-        try:
-            await cleanup_task
-        except asyncio.CancelledError:
-            pass
-    client.close()
+        shutdown_event.set()
+        pending.append(cleanup_task)
+    await asyncio.gather(*pending, return_exceptions=True)
 
 async def auto_cleanup_inactive_subgroups():
-    """Background task that automatically cleans up inactive or empty sub-groups"""
-    while True:
+    """Background task that cleans up empty sub-groups.
+
+    On a replica set this follows queue deletions through a change stream, so it only does
+    work when participants actually go away (including TTL expiry and full resets).
+    Elsewhere it falls back to a periodic sweep.
+    """
+    try:
+        await watch_queue_deletions()
+        return
+    except Exception as e:
+        if shutdown_event.is_set():
+            return  # Stream torn down by the client closing during shutdown
+        logger.info(f"Queue change stream unavailable ({e}), using periodic sub-group sweep")
+    
+    await sweep_empty_subgroups_periodically()
+
+
+async def wait_for_shutdown(timeout: float) -> bool:
+    """Wait up to timeout seconds, returning True early if shutdown was requested"""
+    try:
+        await asyncio.wait_for(shutdown_event.wait(), timeout=timeout)
+        return True
+    except asyncio.TimeoutError:
+        return False
+
+
+async def watch_queue_deletions():
+    global queue_stream_active
+    pipeline = [{"$match": {"operationType": "delete"}}]
+    async with db.queue.watch(
+        pipeline,
+        full_document_before_change="whenAvailable",
+        max_await_time_ms=CHANGE_STREAM_MAX_AWAIT_MS
+    ) as stream:
+        logger.info("Watching queue deletions for sub-group cleanup")
+        queue_stream_active = True
         try:
-            await asyncio.sleep(60)  # Check every 60 seconds
+            # Catch anything emptied while we weren't watching (downtime, never-joined sub-groups)
+            await run_cleanup_step(sweep_empty_subgroups())
             
-            all_participants = await db.queue.find().to_list(100)
-            active_subgroups = set(p.get("subGroup") for p in all_participants)
-            
-            all_subgroups = await db.subgroups.find({}).to_list(100)
+            needs_sweep = False
+            while not shutdown_event.is_set():
+                change = await stream.try_next()
+                if change is None:
+                    # Stream drained - one sweep covers every delete that had no pre-image
+                    if needs_sweep:
+                        await run_cleanup_step(sweep_empty_subgroups())
+                        needs_sweep = False
+                    continue
+                
+                sg_name = (change.get("fullDocumentBeforeChange") or {}).get("subGroup")
+                if sg_name:
+                    await run_cleanup_step(cleanup_subgroup_if_empty(sg_name))
+                else:
+                    # No pre-image recorded, so we don't know which sub-group emptied
+                    needs_sweep = True
+        finally:
+            queue_stream_active = False
+
+
+async def run_cleanup_step(coro):
+    """Run one cleanup operation, logging failures so they don't end the change stream"""
+    try:
+        await coro
+    except Exception as e:
+        logger.error(f"Error in auto-cleanup task: {e}")
+
+
+async def sweep_empty_subgroups() -> int:
+    """Delete every empty sub-group other than General, returning how many were removed"""
+    stale = [sg["name"] async for sg in db.subgroups.aggregate(EMPTY_SUBGROUPS_PIPELINE)]
+    
+    if not stale:
+        return 0
+    
+    result, _ = await asyncio.gather(
+        db.subgroups.delete_many({"name": {"$in": stale}}),
+        db.counters.delete_many({"_id": {"$in": stale}})
+    )
+    
+    # Joins that landed between the aggregation and the delete need their sub-groups back
+    rejoined = await db.queue.distinct("subGroup", {"subGroup": {"$in": stale}})
+    for name in rejoined:
+        await ensure_subgroup(name)
+    
+    logger.info(f"Auto-cleaned {result.deleted_count} inactive sub-groups: {stale}")
+    return result.deleted_count - len(rejoined)
+
+
+async def sweep_empty_subgroups_periodically():
+    """Sweep for empty sub-groups, backing off while sweeps find nothing and resetting once one does.
+
+    Removals clean up their own sub-group via cleanup_subgroup_if_empty; this catches
+    sub-groups emptied another way (TTL expiry, full resets).
+    """
+    interval = CLEANUP_MIN_INTERVAL
+    error_backoff = CLEANUP_ERROR_BACKOFF
+    wait = interval
+    while not await wait_for_shutdown(wait):
+        try:
+            cleaned_count = await sweep_empty_subgroups()
             
-            for sg in all_subgroups:
-                sg_name = sg.get("name")
-                if sg_name and sg_name != "General" and sg_name not in active_subgroups:
-                    await db.subgroups.delete_one({"name": sg_name})
-                    logger.info(f"Auto-cleaned inactive sub-group: {sg_name}")
+            if cleaned_count == 0:
+                interval = min(interval * CLEANUP_BACKOFF_FACTOR, CLEANUP_MAX_INTERVAL)
+            else:
+                interval = CLEANUP_MIN_INTERVAL
+            error_backoff = CLEANUP_ERROR_BACKOFF
+            wait = interval
                     
-        except asyncio.CancelledError:
-            break
         except Exception as e:
             logger.error(f"Error in auto-cleanup task: {e}")
-            await asyncio.sleep(60)
+            # Retry after the error backoff alone, not on top of the regular interval
+            wait = error_backoff
+            error_backoff = min(error_backoff * 2, CLEANUP_MAX_ERROR_BACKOFF)